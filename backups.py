@@ -1,16 +1,269 @@
+import collections
+import hashlib
 import os
 import subprocess
+import threading
+import time
 import logging
-import json
-from datetime import datetime
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+import mimetypes
+import queue
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload, MediaUpload
+
+from drive_client import get_drive_service
+
+logger = logging.getLogger(__name__)
+
+# Default chunk size for resumable uploads; fewer, larger chunks mean fewer round-trips.
+# Override with DRIVE_CHUNK_SIZE (bytes). A streamed upload holds up to five chunks in memory:
+# the one being sent, two looked ahead to spot the end of the stream, one queued and one being
+# read (320 MiB at this default). A file upload holds up to three (192 MiB).
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Drive's resumable protocol requires chunks to be a multiple of 256 KiB
+CHUNK_SIZE_MULTIPLE = 256 * 1024
+
+# Files smaller than this are sent in a single multipart request instead of a resumable session
+SMALL_UPLOAD_LIMIT = 5 * 1024 * 1024
+
+# Directory backups start over with a full archive once the last one is this old (seconds)
+FULL_BACKUP_INTERVAL = 7 * 24 * 60 * 60
+
+# Drive rejects batch requests with more than 100 calls
+DRIVE_BATCH_LIMIT = 100
+
+# Read size for hashing local backups before upload
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+# Consecutive failed chunks a resumable upload retries from Drive's committed offset before giving up
+RESUMABLE_UPLOAD_RETRIES = 5
+
+
+class PipeUpload(MediaUpload):
+    """
+    Resumable media upload that reads from an unseekable stream, such as the
+    stdout of a subprocess. The total size is only known once the stream is
+    exhausted, and the most recent chunk is kept so it can be re-sent on retry.
+    A background thread reads the next chunk while the current one is being
+    sent, so the producing process is not stalled by the network.
+    An MD5 of everything read is computed on the fly for verifying the upload.
+    """
+
+    def __init__(self, stream, mimetype, chunksize=DEFAULT_CHUNK_SIZE):
+        super().__init__()
+        self._stream = stream
+        self._mimetype = mimetype
+        self._chunksize = chunksize
+        self._chunk = b""
+        self._chunk_start = 0
+        self._pending = collections.deque()
+        self._pending_size = 0
+        self._eof = False
+        self._total = None
+        self._md5 = hashlib.md5()
+        self._queue = queue.Queue(maxsize=1)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._prefetch, daemon=True)
+        self._thread.start()
+
+    def _prefetch(self):
+        try:
+            while not self._closed.is_set():
+                # Read straight into a fresh chunk-sized buffer, no intermediate copies
+                data = bytearray(self._chunksize)
+                view = memoryview(data)
+                filled = 0
+                while filled < self._chunksize:
+                    n = self._stream.readinto(view[filled:])
+                    if not n:
+                        break
+                    filled += n
+                view.release()
+                if filled < self._chunksize:
+                    del data[filled:]
+                self._md5.update(data)
+                self._put(data)
+                if filled < self._chunksize:
+                    # Signal end of stream after the final, short chunk
+                    self._put(b"")
+                    break
+        except Exception as e:
+            # Hand any failure to _fill, which would otherwise wait for a chunk forever
+            self._put(e)
+
+    def _put(self, item):
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def _fill(self, length):
+        """
+        Waits until at least `length` bytes are pending or the stream has ended.
+        """
+        while self._pending_size < length and not self._eof:
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                raise item
+            if not item:
+                self._eof = True
+            else:
+                self._pending.append(item)
+                self._pending_size += len(item)
+
+    def size(self):
+        # Report the total as soon as the next chunk is known to be the last one, so
+        # it is sent as final even when the stream ends exactly on a chunk boundary
+        if self._total is None:
+            self._fill(self._chunksize + 1)
+            if self._eof:
+                self._total = self._chunk_start + len(self._chunk) + self._pending_size
+        return self._total
+
+    def resumable(self):
+        return True
+
+    def getbytes(self, begin, length):
+        if begin < self._chunk_start:
+            raise ValueError(f"Cannot rewind stream to offset {begin}")
+
+        offset = begin - self._chunk_start
+        self._fill(length - max(0, len(self._chunk) - offset))
+
+        if offset >= len(self._chunk) and self._pending and len(self._pending[0]) == length:
+            # Usual case: the next prefetched chunk is exactly what is asked for, hand it over as is
+            data = self._pending.popleft()
+            self._pending_size -= len(data)
+        else:
+            # After a partial retry, stitch the unacknowledged tail and prefetched data together
+            data = bytearray(memoryview(self._chunk)[offset:])
+            while len(data) < length and self._pending:
+                head = self._pending.popleft()
+                take = length - len(data)
+                data += memoryview(head)[:take]
+                if take < len(head):
+                    self._pending.appendleft(head[take:])
+                self._pending_size -= min(take, len(head))
+
+        self._chunk = data
+        self._chunk_start = begin
+        return data
+
+    def md5_hexdigest(self):
+        """
+        Returns the MD5 of all bytes read from the stream so far.
+        """
+        return self._md5.hexdigest()
+
+    def close(self):
+        """
+        Stops the prefetch thread. The stream is left open for the caller to close.
+        """
+        self._closed.set()
+
+
+class PrefetchUpload(MediaUpload):
+    """
+    Resumable media upload for a local file that reads the next chunk on a
+    background thread while the current one is being sent, so disk reads
+    overlap with the network. At most three chunks are held in memory: the one
+    being sent, one queued and one read ahead.
+    """
+
+    def __init__(self, fd, size, mimetype, chunksize=DEFAULT_CHUNK_SIZE):
+        super().__init__()
+        self._fd = fd
+        self._size = size
+        self._mimetype = mimetype
+        self._chunksize = chunksize
+        self._next_offset = 0
+        self._queue = queue.Queue(maxsize=1)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._prefetch, daemon=True)
+        self._thread.start()
+
+    def _prefetch(self):
+        offset = 0
+        try:
+            while offset < self._size and not self._closed.is_set():
+                data = os.pread(self._fd, self._chunksize, offset)
+                if not data:
+                    raise EOFError(f"File ended at byte {offset} of {self._size}")
+                # The chunk now lives in our buffer, so don't let a write-once archive crowd the page cache
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(self._fd, offset, len(data), os.POSIX_FADV_DONTNEED)
+                self._put((offset, data))
+                offset += len(data)
+        except Exception as e:
+            # Hand the failure to getbytes, which would otherwise wait for a chunk forever
+            self._put(e)
+
+    def _put(self, item):
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        return self._size
+
+    def resumable(self):
+        return True
+
+    def getbytes(self, begin, length):
+        if begin == self._next_offset and length == self._chunksize:
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                raise item
+            offset, data = item
+            self._next_offset = offset + len(data)
+            return data
+
+        # Retried or resumed ranges fall outside the prefetched sequence, read them directly
+        return os.pread(self._fd, length, begin)
+
+    def close(self):
+        """
+        Stops the prefetch thread. The file descriptor is left open for the caller to close.
+        """
+        self._closed.set()
+        self._thread.join()
+
 
 class BackupManager:
     def __init__(self):
-        logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
-        self.logger = logging.getLogger(__name__)
+        self.logger = logger
+        self.gitlab_backup_directory = '/var/opt/gitlab/backups'
+        self.backup_root = '/var/backups'
+        # Skip sudo (and its PAM round-trip per command) when already running as root
+        self._sudo = [] if os.geteuid() == 0 else ['sudo', '-n']
+        # 'pigz' writes gzip archives (.tar.gz), 'zstd' writes multi-threaded zstd archives (.tar.zst)
+        self.compression = os.getenv("BACKUP_COMPRESSION", "pigz")
+        if self.compression not in ("pigz", "zstd"):
+            raise ValueError("Invalid BACKUP_COMPRESSION. Use 'pigz' or 'zstd'.")
+        # Round down to what Drive accepts, but never below a single 256 KiB unit
+        chunk_size = int(os.getenv("DRIVE_CHUNK_SIZE", DEFAULT_CHUNK_SIZE))
+        self.chunk_size = max(CHUNK_SIZE_MULTIPLE, chunk_size - chunk_size % CHUNK_SIZE_MULTIPLE)
 
     def create_gitlab_backup(self):
         """
@@ -18,34 +271,36 @@ class BackupManager:
         Finds and returns the latest GitLab backup file.
         """
         try:
-            backup_directory = '/var/opt/gitlab/backups'
-            # Run GitLab backup with sudo
-            subprocess.run(['sudo', 'gitlab-backup', 'create'], check=True)
-
-            # Find the most recent backup
-            backups = [
-                os.path.join(backup_directory, f)
-                for f in os.listdir(backup_directory)
-                if f.endswith('_gitlab_backup.tar')
-            ]
-            
-            if not backups:
-                raise FileNotFoundError("No GitLab backup files found after backup creation")
+            # Drive services are per thread, so build one on the thread that will upload,
+            # overlapping the client setup and token fetch with `gitlab-backup create`.
+            # A failure here is not fatal, the upload sets the client up again.
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(get_drive_service)
+
+                # Run GitLab backup with sudo unless already root
+                subprocess.run([*self._sudo, 'gitlab-backup', 'create'], check=True)
+
+                # Find the most recent backup
+                latest_backup, older_backups = self._latest_backup(
+                    self.gitlab_backup_directory, ('_gitlab_backup.tar',)
+                )
                 
-            # Sort backups by creation time
-            backups.sort(key=os.path.getctime, reverse=True)
-            latest_backup = backups[0]
-
-            # Remove older backups locally
-            for backup in backups[1:]:
-                try:
-                    subprocess.run(['sudo', 'rm', backup], check=True)
-                    self.logger.info(f"Removed old backup: {backup}")
-                except subprocess.CalledProcessError:
-                    self.logger.warning(f"Permission denied when removing: {backup}")
-
-            self.logger.info(f"Latest GitLab backup file: {latest_backup}")
-            self.upload_to_google_drive(file_path=latest_backup, google_drive_folder_id='1SNuXyvSqpff3_U2uzDM9ZfVicwMfr8eV')
+                if latest_backup is None:
+                    raise FileNotFoundError("No GitLab backup files found after backup creation")
+
+                self.logger.info(f"Latest GitLab backup file: {latest_backup}")
+
+                # Upload in the background while older backups are removed locally
+                upload = executor.submit(
+                    self.upload_to_google_drive,
+                    file_path=latest_backup,
+                    google_drive_folder_id='1SNuXyvSqpff3_U2uzDM9ZfVicwMfr8eV'
+                )
+
+                # Remove older backups locally
+                self._remove_backups(older_backups)
+
+                upload.result()
             
             return latest_backup
 
@@ -55,57 +310,94 @@ class BackupManager:
 
     def create_directory_backup(self, backup_name, directories):
         """
-        Creates a `.tar.gz` archive for the given directories.
-        Stores backups in a dedicated subfolder.
+        Creates a `.tar.gz` (or `.tar.zst` with BACKUP_COMPRESSION=zstd) archive for the given
+        directories and streams it straight to Google Drive, without staging it on local disk.
+        Directories tagged with a CACHEDIR.TAG file are left out.
+
+        A full archive is made weekly; in between, each archive is a GNU tar level-1
+        incremental holding only what changed since that full one. Restoring takes the
+        latest `_full` archive followed by the latest `_incr` archive, both kept on Drive.
 
         :param backup_name: Name of the service being backed up (e.g., 'jenkins')
         :param directories: List of directories to include in the archive
-        :return: Path to the created backup file
+        :return: Name of the uploaded backup file
         """
         try:
-            backup_dir = f"/var/backups/{backup_name}"
-            os.makedirs(backup_dir, exist_ok=True)
-            subprocess.run(["sudo", "chmod", "755", backup_dir], check=True)
-
             timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            snapshot_dir = f"/tmp/{backup_name}_snapshot_{timestamp}"
+            state_dir = os.path.join(self.backup_root, backup_name)
+            # Kept between runs so rsync only copies changes and tar can tell what changed
+            snapshot_dir = os.path.join(state_dir, "snapshot")
             os.makedirs(snapshot_dir, exist_ok=True)
 
+            # Check all directories concurrently so slow mounts don't stack up
+            with ThreadPoolExecutor(max_workers=min(32, len(directories) or 1)) as executor:
+                exists = list(executor.map(os.path.exists, directories))
+
+            # Drop snapshot copies of directories that are gone or no longer listed,
+            # otherwise tar would keep archiving them as if they were current
+            current = {
+                os.path.basename(d.rstrip('/'))
+                for d, found in zip(directories, exists)
+                if found
+            }
+            with os.scandir(snapshot_dir) as it:
+                stale = [e.path for e in it if e.name not in current]
+            if stale:
+                self.logger.info(f"Removing stale snapshot entries: {', '.join(stale)}")
+                subprocess.run([*self._sudo, "rm", "-rf", "--", *stale], check=True)
+
             # Rsync each directory to snapshot location
-            for d in directories:
-                if os.path.exists(d):
+            for d, found in zip(directories, exists):
+                if found:
                     basename = os.path.basename(d.rstrip('/'))
                     dest_path = os.path.join(snapshot_dir, basename)
-                    rsync_cmd = ["sudo", "rsync", "-a", "--delete", d + "/", dest_path]
+                    rsync_cmd = [*self._sudo, "rsync", "-a", "--delete", d + "/", dest_path]
                     self.logger.info(f"Running rsync: {' '.join(rsync_cmd)}")
                     subprocess.run(rsync_cmd, check=True)
                 else:
                     self.logger.warning(f"Directory not found, skipping: {d}")
 
-            backup_file = f"{backup_dir}/{backup_name}_backup_{timestamp}.tar.gz"
-            tar_cmd = ["sudo", "tar", "-czf", backup_file, "-C", snapshot_dir, "."]
-            self.logger.info(f"Creating archive: {' '.join(tar_cmd)}")
-            subprocess.run(tar_cmd, check=True)
-            subprocess.run(["sudo", "chmod", "644", backup_file], check=True)
-
-            # Clean up the snapshot folder
-            subprocess.run(["sudo", "rm", "-rf", snapshot_dir], check=True)
-
-            self.logger.info(f"{backup_name.capitalize()} backup created: {backup_file}")
+            # The full backup's tar snapshot file is the baseline for every incremental after it
+            base_snar = os.path.join(state_dir, f"{backup_name}.snar")
+            full = (
+                not os.path.exists(base_snar)
+                or time.time() - os.path.getmtime(base_snar) > FULL_BACKUP_INTERVAL
+            )
+            if full:
+                # tar starts a level-0 archive when the snapshot file does not exist
+                snar = f"{base_snar}.new"
+                if os.path.exists(snar):
+                    os.remove(snar)
+            else:
+                # Work on a copy so every incremental stays relative to the full backup
+                snar = f"{base_snar}.incr"
+                shutil.copyfile(base_snar, snar)
 
-            # Remove old backups
-            backups = [
-                os.path.join(backup_dir, f)
-                for f in os.listdir(backup_dir)
-                if f.startswith(f"{backup_name}_backup_") and f.endswith(".tar.gz")
+            compress_cmd, extension, mimetype = self._compress_command()
+            level = "full" if full else "incr"
+            backup_file = f"{backup_name}_backup_{timestamp}_{level}{extension}"
+            # Archive and compress in separate processes so disk reads overlap with compression
+            tar_cmd = [
+                *self._sudo, "tar", "--exclude-caches-all", "--listed-incremental", snar,
+                "-cf", "-", "-C", snapshot_dir, "."
             ]
-            backups.sort(key=os.path.getctime, reverse=True)
-            for old_backup in backups[1:]:
-                subprocess.run(["sudo", "rm", old_backup], check=True)
-                self.logger.info(f"Removed old backup: {old_backup}")
+            pipeline = [tar_cmd, compress_cmd]
+            self.logger.info(f"Streaming archive: {' | '.join(' '.join(cmd) for cmd in pipeline)}")
+            self.stream_to_google_drive(
+                pipeline,
+                backup_file,
+                google_drive_folder_id='1roM3QbZJs2Ck2eQr3t7Zh5zSWd3Wfs5d',
+                mimetype=mimetype,
+                keep_marker=None if full else "_full."
+            )
 
-            self.logger.info(f"Uploading backup file: {backup_file}")
-            self.upload_to_google_drive(file_path=backup_file, google_drive_folder_id='1roM3QbZJs2Ck2eQr3t7Zh5zSWd3Wfs5d')
+            # Only adopt the new baseline once its archive is safely on Drive
+            if full:
+                os.replace(snar, base_snar)
+            else:
+                os.remove(snar)
+
+            self.logger.info(f"{backup_name.capitalize()} backup created: {backup_file}")
 
             return backup_file
 
@@ -113,74 +405,308 @@ class BackupManager:
             self.logger.error(f"{backup_name.capitalize()} backup failed: {e}")
             raise
 
+    def _latest_backup(self, directory, suffixes):
+        """
+        Finds the newest backup file in `directory` in a single scan, without sorting.
+        Backup names start with their creation timestamp, so the greatest name is the newest.
+
+        :param directory: Directory holding the backups
+        :param suffixes: Tuple of file name suffixes identifying backup files
+        :return: Tuple of the newest backup path (None if there is none) and the older ones
+        """
+        latest = None
+        older = []
+        with os.scandir(directory) as it:
+            for e in it:
+                if not (e.name.endswith(suffixes) and e.is_file(follow_symlinks=False)):
+                    continue
+                if latest is None:
+                    latest = e
+                elif e.name > latest.name:
+                    older.append(latest.path)
+                    latest = e
+                else:
+                    older.append(e.path)
+        return (latest.path if latest else None), older
+
+    def _remove_backups(self, backups):
+        """
+        Removes the given backup files directly, falling back to a single `sudo rm`
+        for the ones this process is not allowed to delete.
+        """
+        # Per-file log lines are built lazily and skipped entirely when INFO is off
+        log_removed = self.logger.isEnabledFor(logging.INFO)
+        denied = []
+        for backup in backups:
+            try:
+                os.remove(backup)
+                if log_removed:
+                    self.logger.info("Removed old backup: %s", backup)
+            except PermissionError:
+                denied.append(backup)
+
+        if denied:
+            try:
+                subprocess.run([*self._sudo, 'rm', '-f', *denied], check=True)
+                if log_removed:
+                    for backup in denied:
+                        self.logger.info("Removed old backup: %s", backup)
+            except subprocess.CalledProcessError:
+                self.logger.warning("Permission denied when removing: %s", ", ".join(denied))
+
+    def _compress_command(self):
+        """
+        Picks the compressor for directory archives based on `self.compression`.
+
+        :return: Tuple of (command reading stdin and writing stdout, file extension, mimetype)
+        """
+        if self.compression == "zstd":
+            if shutil.which("zstd"):
+                return ["zstd", "-T0", "-3", "-c"], ".tar.zst", "application/zstd"
+            self.logger.warning("zstd not found, falling back to gzip compression")
+
+        # Use pigz across all usable cores (like `nproc`, honouring CPU affinity) when available
+        # and plain gzip otherwise
+        if shutil.which("pigz"):
+            if hasattr(os, "sched_getaffinity"):
+                threads = len(os.sched_getaffinity(0))
+            else:
+                threads = os.cpu_count() or 1
+            return ["pigz", "-p", str(threads), "-c"], ".tar.gz", "application/gzip"
+        return ["gzip", "-c"], ".tar.gz", "application/gzip"
+
     def upload_to_google_drive(self, file_path, google_drive_folder_id):
         """
         Uploads a backup file to Google Drive and cleans up old backups.
+        The upload is skipped when the folder already holds a file with the same SHA-256.
         """
         try:
             self.logger.info(f"Starting Google Drive upload for {file_path}")
-            google_credentials_json_path = "cred.json"
+            drive_service = get_drive_service()
 
-            with open(google_credentials_json_path, "r") as f:
-                credentials_dict = json.load(f)
+            # 1. Upload the new file, unless identical content is already there
+            sha256 = self._file_sha256(file_path)
+            uploaded_file = self._find_drive_file_by_sha256(drive_service, google_drive_folder_id, sha256)
+            if uploaded_file:
+                self.logger.info(
+                    f"Identical backup already in Google Drive, skipping upload: "
+                    f"{uploaded_file['name']} (ID: {uploaded_file['id']})"
+                )
+                drive_service.files().update(
+                    fileId=uploaded_file['id'],
+                    body={"modifiedTime": datetime.now(timezone.utc).isoformat()}
+                ).execute()
+            else:
+                uploaded_file = self._upload_file(drive_service, file_path, google_drive_folder_id, {"sha256": sha256})
 
-            credentials = service_account.Credentials.from_service_account_info(
-                credentials_dict,
-                scopes=["https://www.googleapis.com/auth/drive.file"]
-            )
-            drive_service = build("drive", "v3", credentials=credentials)
+            # 2. Now handle cleanup separately, keeping the file that was just uploaded
+            self.clean_drive_folder(drive_service, google_drive_folder_id, uploaded_file['id'], uploaded_file['createdTime'])
+            
+            return uploaded_file['id']
 
-            # 1. Upload the new file
-            file_metadata = {
-                "name": os.path.basename(file_path),
-                'parents': [google_drive_folder_id] if google_drive_folder_id else []
-            }
+        except Exception as e:
+            self.logger.error(f"Google Drive upload failed: {e}")
+            raise
 
-            media = MediaFileUpload(
-                file_path,
-                resumable=True
-            )
+    def _upload_file(self, drive_service, file_path, google_drive_folder_id, app_properties):
+        """
+        Uploads a local file to the given Drive folder and returns the new file's Drive metadata.
+        """
+        # Read the file unbuffered, straight from the page cache
+        with open(file_path, "rb", buffering=0) as f:
+            # Hint the kernel to read ahead aggressively, the file is read once front to back
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            size = os.fstat(f.fileno()).st_size
+            mimetype = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
 
-            uploaded_file = drive_service.files().create(
-                body=file_metadata,
-                media_body=media,
-                fields="id,name,createdTime"
-            ).execute()
+            if size < SMALL_UPLOAD_LIMIT:
+                media = MediaIoBaseUpload(f, mimetype=mimetype, resumable=False)
+                return self._create_drive_file(
+                    drive_service, os.path.basename(file_path), google_drive_folder_id, media, app_properties
+                )
 
-            file_id = uploaded_file.get('id')
-            file_name = uploaded_file.get('name')
-            self.logger.info(f"File uploaded successfully. File ID: {file_id}, Name: {file_name}")
-            
-            # 2. Add a delay to ensure the file is indexed (3-5 seconds usually sufficient)
-            import time
-            time.sleep(5)
-            
-            # 3. Now handle cleanup separately
-            self.clean_drive_folder(drive_service, google_drive_folder_id)
-            
-            return file_id
+            # Read the next chunk from disk while the current one is being uploaded
+            media = PrefetchUpload(f.fileno(), size, mimetype, chunksize=self.chunk_size)
+            try:
+                return self._create_drive_file(
+                    drive_service, os.path.basename(file_path), google_drive_folder_id, media, app_properties,
+                    resumable=True
+                )
+            finally:
+                media.close()
+
+    def _file_sha256(self, file_path):
+        """
+        Returns the hex SHA-256 of a local file. Like the upload, it reads the file once front
+        to back and drops each block from the page cache once hashed, so hashing a multi-GB
+        archive does not push everything else out of memory.
+        """
+        digest = hashlib.sha256()
+        block = bytearray(HASH_BLOCK_SIZE)
+        view = memoryview(block)
+        with open(file_path, "rb", buffering=0) as f:
+            fd = f.fileno()
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            offset = 0
+            while n := f.readinto(block):
+                digest.update(view[:n])
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(fd, offset, n, os.POSIX_FADV_DONTNEED)
+                offset += n
+        return digest.hexdigest()
+
+    def _find_drive_file_by_sha256(self, drive_service, folder_id, sha256):
+        """
+        Returns the Drive metadata of a file in `folder_id` uploaded with the given SHA-256,
+        or None if there is none.
+        """
+        query = (
+            f"'{folder_id}' in parents and trashed=false "
+            f"and appProperties has {{ key='sha256' and value='{sha256}' }}"
+        )
+        results = drive_service.files().list(
+            q=query,
+            fields="files(id, name, createdTime)",
+            pageSize=1
+        ).execute()
+        files = results.get("files", [])
+        return files[0] if files else None
+
+    def stream_to_google_drive(self, pipeline, file_name, google_drive_folder_id, mimetype="application/gzip", keep_marker=None):
+        """
+        Runs `pipeline`, a list of commands each feeding its stdout to the next, and uploads
+        the last command's stdout to Google Drive as `file_name`, then cleans up old backups.
+        If any command fails, the partial upload is deleted and old backups are left untouched.
+        `keep_marker` is passed on to `clean_drive_folder`.
+        """
+        try:
+            self.logger.info(f"Starting Google Drive stream upload for {file_name}")
+            drive_service = get_drive_service()
+
+            # 1. Upload the pipeline output as it is produced
+            procs = []
+            stdout = None
+            for cmd in pipeline:
+                proc = subprocess.Popen(cmd, stdin=stdout, stdout=subprocess.PIPE, bufsize=0)
+                if stdout is not None:
+                    # Only the next stage should hold the read end, so it sees EOF/SIGPIPE
+                    stdout.close()
+                procs.append(proc)
+                stdout = proc.stdout
+
+            media = PipeUpload(stdout, mimetype=mimetype, chunksize=self.chunk_size)
+            try:
+                uploaded_file = self._create_drive_file(drive_service, file_name, google_drive_folder_id, media)
+            finally:
+                media.close()
+                stdout.close()
+                returncodes = [proc.wait() for proc in procs]
+
+            for cmd, returncode in zip(pipeline, returncodes):
+                if returncode != 0:
+                    drive_service.files().delete(fileId=uploaded_file['id']).execute()
+                    self.logger.warning(f"Removed incomplete upload from Drive: {file_name} (ID: {uploaded_file['id']})")
+                    raise subprocess.CalledProcessError(returncode, cmd)
+
+            # Verify what Drive stored against the checksum computed while streaming
+            if uploaded_file.get('md5Checksum') != media.md5_hexdigest():
+                drive_service.files().delete(fileId=uploaded_file['id']).execute()
+                self.logger.warning(f"Removed corrupted upload from Drive: {file_name} (ID: {uploaded_file['id']})")
+                raise ValueError(
+                    f"Checksum mismatch for {file_name}: "
+                    f"sent {media.md5_hexdigest()}, Drive has {uploaded_file.get('md5Checksum')}"
+                )
+
+            # 2. Now handle cleanup separately, keeping the file that was just uploaded
+            self.clean_drive_folder(
+                drive_service, google_drive_folder_id, uploaded_file['id'], uploaded_file['createdTime'], keep_marker
+            )
+
+            return uploaded_file['id']
 
         except Exception as e:
-            self.logger.error(f"Google Drive upload failed: {e}")
+            self.logger.error(f"Google Drive stream upload failed: {e}")
             raise
 
+    def _create_drive_file(self, drive_service, file_name, google_drive_folder_id, media, app_properties=None,
+                           resumable=False):
+        """
+        Creates `file_name` in the given Drive folder from `media`, tagged with `app_properties`.
+        Returns the Drive metadata of the new file (`id`, `name`, `createdTime` and `md5Checksum`).
+        With `resumable`, a chunk lost to a network or server error is retried from the offset
+        Drive has committed instead of failing the whole upload.
+        """
+        file_metadata = {
+            "name": file_name,
+            'parents': [google_drive_folder_id] if google_drive_folder_id else []
+        }
+        if app_properties:
+            file_metadata["appProperties"] = app_properties
+
+        request = drive_service.files().create(
+            body=file_metadata,
+            media_body=media,
+            fields="id,name,createdTime,md5Checksum"
+        )
+        if resumable:
+            uploaded_file = self._execute_resumable(request, file_name)
+        else:
+            uploaded_file = request.execute()
 
-    def clean_drive_folder(self, drive_service, folder_id):
+        self.logger.info(f"File uploaded successfully. File ID: {uploaded_file.get('id')}, Name: {uploaded_file.get('name')}")
+        return uploaded_file
+
+
+    def _execute_resumable(self, request, file_name):
+        """
+        Runs a resumable upload chunk by chunk. When a chunk fails with a network error or a
+        retryable Drive status, the client asks Drive for the committed range of the same session
+        on the next attempt and carries on from there, up to RESUMABLE_UPLOAD_RETRIES times in a row.
+        """
+        failures = 0
+        response = None
+        while response is None:
+            try:
+                _, response = request.next_chunk()
+                failures = 0
+            except (OSError, httplib2.HttpLib2Error, HttpError) as e:
+                retryable = not isinstance(e, HttpError) or e.resp.status == 429 or e.resp.status >= 500
+                if not retryable or failures >= RESUMABLE_UPLOAD_RETRIES:
+                    raise
+                failures += 1
+                self.logger.warning(f"Drive upload of {file_name} interrupted, retrying ({failures}/{RESUMABLE_UPLOAD_RETRIES}): {e}")
+                time.sleep(2 ** failures)
+        return response
+
+    def clean_drive_folder(self, drive_service, folder_id, keep_id, keep_time, keep_marker=None):
         """
         Separate function to clean up a Google Drive folder, keeping only the most recent file.
+        Deletes every file created up to `keep_time` other than `keep_id`, so the just-uploaded
+        file is kept even if the listing does not include it yet. When `keep_marker` is given,
+        the newest file whose name contains it is kept as well (e.g. the full backup that an
+        incremental one builds on).
         """
         try:
             self.logger.info(f"Cleaning up old backups in Google Drive folder: {folder_id}")
             
-            # Get all files in the folder
+            # Get all files in the folder, newest first as ordered by the server
             query = f"'{folder_id}' in parents and trashed=false"
-            results = drive_service.files().list(
-                q=query, 
-                fields="files(id, name, createdTime)",
-                orderBy="createdTime desc"  # Request sorted by creation time (newest first)
-            ).execute()
-            
-            files = results.get("files", [])
+            files = []
+            page_token = None
+            while True:
+                results = drive_service.files().list(
+                    q=query,
+                    fields="nextPageToken, files(id, name, createdTime)",
+                    orderBy="createdTime desc",
+                    pageSize=1000,
+                    pageToken=page_token
+                ).execute()
+                files.extend(results.get("files", []))
+                page_token = results.get("nextPageToken")
+                if not page_token:
+                    break
             
             if not files:
                 self.logger.info("No backup files found in Google Drive.")
@@ -188,20 +714,44 @@ class BackupManager:
                 
             self.logger.info(f"Found {len(files)} backups in Google Drive")
             
-            # Re-sort to ensure newest first (belt and suspenders approach)
-            files.sort(key=lambda x: x['createdTime'], reverse=True)
-            
-            self.logger.info(f"Keeping latest backup: {files[0]['name']} (ID: {files[0]['id']}, Created: {files[0]['createdTime']})")
+            self.logger.info(f"Keeping latest backup: ID: {keep_id}, Created: {keep_time}")
+
+            keep_ids = {keep_id}
+            if keep_marker:
+                base = next((file for file in files if keep_marker in file["name"]), None)
+                if base:
+                    keep_ids.add(base["id"])
+                    self.logger.info(f"Keeping base backup: {base['name']} (ID: {base['id']}, Created: {base['createdTime']})")
             
-            # Delete all but the first (newest) file
-            if len(files) > 1:
-                self.logger.info(f"Deleting {len(files)-1} older backups from Google Drive")
-                for file in files[1:]:
-                    try:
-                        drive_service.files().delete(fileId=file["id"]).execute()
-                        self.logger.info(f"Deleted old backup from Drive: {file['name']} (ID: {file['id']}, Created: {file['createdTime']})")
-                    except Exception as e:
-                        self.logger.warning(f"Failed to delete {file['name']} from Drive: {e}")
+            # Delete everything older than the kept file
+            old_files = {
+                file["id"]: file
+                for file in files
+                if file["id"] not in keep_ids and file["createdTime"] <= keep_time
+            }
+            if old_files:
+                self.logger.info(f"Deleting {len(old_files)} older backups from Google Drive")
+
+                log_deleted = self.logger.isEnabledFor(logging.INFO)
+
+                def log_delete(request_id, response, exception):
+                    file = old_files[request_id]
+                    if exception is None:
+                        if log_deleted:
+                            self.logger.info(
+                                "Deleted old backup from Drive: %s (ID: %s, Created: %s)",
+                                file['name'], file['id'], file['createdTime']
+                            )
+                    else:
+                        self.logger.warning("Failed to delete %s from Drive: %s", file['name'], exception)
+
+                # Send deletes in batch requests instead of one round-trip each
+                old_ids = list(old_files)
+                for start in range(0, len(old_ids), DRIVE_BATCH_LIMIT):
+                    batch = drive_service.new_batch_http_request(callback=log_delete)
+                    for file_id in old_ids[start:start + DRIVE_BATCH_LIMIT]:
+                        batch.add(drive_service.files().delete(fileId=file_id), request_id=file_id)
+                    batch.execute()
         
         except Exception as e:
             self.logger.error(f"Error cleaning up Google Drive folder: {e}")
@@ -0,0 +1,51 @@
+import functools
+import json
+import threading
+
+import google_auth_httplib2
+import httplib2
+from google.oauth2 import service_account
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+SCOPES = ["https://www.googleapis.com/auth/drive.file"]
+
+# Drive services are per thread, their httplib2 transport is not thread-safe
+_local = threading.local()
+
+
+@functools.lru_cache(maxsize=None)
+def _drive_discovery_document():
+    """
+    Returns the Drive v3 discovery document bundled with google-api-python-client,
+    read and parsed once per process.
+    """
+    return json.loads(get_static_doc("drive", "v3"))
+
+
+@functools.lru_cache(maxsize=None)
+def get_credentials(creds_path="cred.json"):
+    """
+    Loads the service account key once per process and fetches its first access token.
+    Only called when the first Drive client is built, so an unreachable Drive or OAuth
+    endpoint fails the upload, never the local backup.
+    """
+    credentials = service_account.Credentials.from_service_account_file(creds_path, scopes=SCOPES)
+    credentials.refresh(google_auth_httplib2.Request(httplib2.Http()))
+    return credentials
+
+
+def get_drive_service(creds_path="cred.json"):
+    """
+    Returns the Google Drive v3 client for the calling thread, built on first use from the
+    shared credentials and discovery document and reused for every later call on that thread.
+    """
+    services = getattr(_local, "services", None)
+    if services is None:
+        services = _local.services = {}
+    if creds_path not in services:
+        services[creds_path] = build_from_document(
+            _drive_discovery_document(),
+            credentials=get_credentials(creds_path)
+        )
+    return services[creds_path]
@@ -1,16 +1,28 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
 from backups import BackupManager
 
 def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
     backup_manager = BackupManager()
 
-    # GitLab Backup (Runs `gitlab-backup create` Automatically)
-    backup_manager.run_backup(backup_name="gitlab", method="gitlab")
-
-    # Jenkins Backup (Creates a `.tar.gz` of Jenkins directories)
     JENKINS_DIRECTORIES = [
         "/var/lib/jenkins"
     ]
-    backup_manager.run_backup("jenkins", method="directory", directories=JENKINS_DIRECTORIES)
+
+    # GitLab and Jenkins touch separate disks and Drive folders, so run both backups at once
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        backups = [
+            # GitLab Backup (Runs `gitlab-backup create` Automatically)
+            executor.submit(backup_manager.run_backup, backup_name="gitlab", method="gitlab"),
+            # Jenkins Backup (Creates a `.tar.gz` of Jenkins directories)
+            executor.submit(backup_manager.run_backup, "jenkins", method="directory", directories=JENKINS_DIRECTORIES),
+        ]
+
+    # Re-raise the first failure once both backups have finished
+    for backup in backups:
+        backup.result()
 
 if __name__ == "__main__":
     main()